@@ -0,0 +1,440 @@
+"""
+Background memory compaction: keeps each namespace's index bounded.
+
+Each pass:
+  1. Retention: deletes memories older than their type's TTL.
+  2. Exact duplicates: keeps the oldest copy per content_hash.
+  3. Near duplicates: for new raw turns, keeps only the newest of any same-type
+     pair within MEMORY_NEAR_DUP_DISTANCE (a correction replaces the old fact).
+  4. Rollups: old raw turns -> weekly summaries -> monthly summaries.
+
+Steps 2-3 only look at items stored since the namespace's last pass, so a pass
+costs what was added, not the size of the store.
+
+Runs from run.py (leader only), or once via `python compaction.py`.
+"""
+import os
+import time
+import sqlite3
+import datetime
+from collections import defaultdict
+
+from memory import memory, content_hash, add_memory
+
+COMPACTION_INTERVAL_SECONDS = int(os.getenv("COMPACTION_INTERVAL_SECONDS", "3600"))
+
+# Squared L2 between normalized embeddings (Chroma's default space); 0.1 ~= cosine 0.95.
+MEMORY_NEAR_DUP_DISTANCE = float(os.getenv("MEMORY_NEAR_DUP_DISTANCE", "0.1"))
+
+# Only raw chat turns are near-deduplicated. Summaries of different periods can
+# look alike but each is the sole record of its period.
+_NEAR_DEDUP_TYPES = ("telegram_user", "telegram_ai")
+
+# Days to keep each memory type; missing types are kept until rolled up.
+# Override with MEMORY_TTL_DAYS="email_draft=30,email_received=180".
+_DEFAULT_TTL_DAYS = {
+    "email_draft": 30,
+    "email_received": 180,
+}
+
+
+def _week_start(d: datetime.datetime) -> datetime.datetime:
+    d = d.replace(hour=0, minute=0, second=0, microsecond=0)
+    return d - datetime.timedelta(days=d.weekday())
+
+
+def _month_start(d: datetime.datetime) -> datetime.datetime:
+    return d.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+# (source types, summary type, roll up after N days, period start, period label)
+_ROLLUP_TIERS = [
+    (("telegram_user", "telegram_ai"), "summary_weekly", int(os.getenv("ROLLUP_WEEKLY_AFTER_DAYS", "14")),
+     _week_start, lambda d: "%d-W%02d" % d.isocalendar()[:2]),
+    (("summary_weekly",), "summary_monthly", int(os.getenv("ROLLUP_MONTHLY_AFTER_DAYS", "120")),
+     _month_start, lambda d: d.strftime("%Y-%m")),
+]
+
+ROLLUP_MAX_CHARS = int(os.getenv("ROLLUP_MAX_CHARS", "12000"))
+
+MODEL = os.getenv("OPENAI_MODEL", "gpt-4.1-mini")
+OPENAI_KEY = os.getenv("OPENAI_API_KEY")
+
+DB_PATH = os.getenv("BRAIN_DB_PATH", "brain.db")
+
+conn = sqlite3.connect(DB_PATH, check_same_thread=False, timeout=30)
+cursor = conn.cursor()
+
+cursor.execute("""
+CREATE TABLE IF NOT EXISTS memory_compaction (
+    namespace TEXT PRIMARY KEY,
+    last_run INTEGER NOT NULL        -- epoch seconds of the last finished pass
+)
+""")
+cursor.execute("""
+CREATE TABLE IF NOT EXISTS compaction_state (
+    key TEXT PRIMARY KEY,
+    value TEXT
+)
+""")
+conn.commit()
+
+_PAGE = 1000
+
+
+def _ttl_days() -> dict:
+    ttl = dict(_DEFAULT_TTL_DAYS)
+    for item in os.getenv("MEMORY_TTL_DAYS", "").split(","):
+        if "=" in item:
+            name, days = item.split("=", 1)
+            ttl[name.strip()] = int(days)
+    return ttl
+
+
+def _get_all(where: dict | None, include: list[str]) -> dict:
+    """
+    Paged collection.get(); returns flat ids plus the requested fields.
+    """
+    out = {"ids": [], **{k: [] for k in include}}
+    offset = 0
+    while True:
+        page = memory.get(where=where, include=include, limit=_PAGE, offset=offset)
+        ids = page.get("ids") or []
+        if not ids:
+            return out
+        out["ids"].extend(ids)
+        for k in include:
+            out[k].extend(page.get(k) if page.get(k) is not None else [None] * len(ids))
+        offset += len(ids)
+
+
+def _delete(ids: list[str]) -> None:
+    for i in range(0, len(ids), _PAGE):
+        memory.delete(ids=ids[i:i + _PAGE])
+
+
+def _known_namespaces() -> dict[str, int]:
+    cursor.execute("SELECT namespace, last_run FROM memory_compaction")
+    return dict(cursor.fetchall())
+
+
+def _register_namespace(namespace: str) -> None:
+    cursor.execute(
+        "INSERT OR IGNORE INTO memory_compaction (namespace, last_run) VALUES (?, 0)",
+        (namespace,),
+    )
+    conn.commit()
+
+
+def _set_last_run(namespace: str, ts: int) -> None:
+    cursor.execute(
+        "INSERT OR REPLACE INTO memory_compaction (namespace, last_run) VALUES (?, ?)",
+        (namespace, ts),
+    )
+    conn.commit()
+
+
+def migrate_once(now: int) -> None:
+    """
+    One-time full scan: stamps memories written before created_at, stored_at
+    and content_hash existed, and registers every namespace. Later passes only
+    look at items stored since their namespace's last run.
+    """
+    cursor.execute("SELECT value FROM compaction_state WHERE key = 'migrated'")
+    if cursor.fetchone():
+        return
+
+    found = _get_all(None, ["documents", "metadatas"])
+    ids, metas = [], []
+    for mem_id, doc, meta in zip(found["ids"], found["documents"], found["metadatas"]):
+        meta = meta or {}
+        namespace = meta.get("namespace")
+        if namespace:
+            _register_namespace(namespace)
+        if "created_at" in meta and "stored_at" in meta and "content_hash" in meta:
+            continue
+        ids.append(mem_id)
+        metas.append({
+            "created_at": now,
+            **meta,
+            "stored_at": meta.get("stored_at", now),
+            "content_hash": meta.get("content_hash") or content_hash(doc or "", namespace or ""),
+        })
+    for i in range(0, len(ids), _PAGE):
+        memory.update(ids=ids[i:i + _PAGE], metadatas=metas[i:i + _PAGE])
+
+    cursor.execute("INSERT OR REPLACE INTO compaction_state (key, value) VALUES ('migrated', ?)", (str(now),))
+    conn.commit()
+    print(f"[COMPACT] migration done, backfilled {len(ids)} memories")
+
+
+def discover_namespaces(since: int) -> dict[str, int]:
+    """
+    Registered namespaces plus any that appeared in items stored since `since`.
+    """
+    found = _get_all({"stored_at": {"$gte": since}}, ["metadatas"])
+    known = _known_namespaces()
+    for meta in found["metadatas"]:
+        namespace = (meta or {}).get("namespace")
+        if namespace and namespace not in known:
+            _register_namespace(namespace)
+            known[namespace] = 0
+    return known
+
+
+def apply_retention(now: int) -> int:
+    removed = 0
+    for doc_type, days in _ttl_days().items():
+        cutoff = now - days * 86400
+        where = {"$and": [{"type": doc_type}, {"created_at": {"$lt": cutoff}}]}
+        ids = _get_all(where, [])["ids"]
+        _delete(ids)
+        removed += len(ids)
+    return removed
+
+
+def dedupe_exact(namespace: str, since: int) -> int:
+    """
+    Looks up only the hashes of items stored since the last pass; content_hash
+    already includes the namespace.
+    """
+    where = {"$and": [{"namespace": namespace}, {"stored_at": {"$gte": since}}]}
+    new = _get_all(where, ["metadatas"])
+    hashes = sorted({m.get("content_hash") for m in new["metadatas"] if m and m.get("content_hash")})
+
+    keep: dict[str, tuple] = {}
+    drop = []
+
+    for i in range(0, len(hashes), _PAGE):
+        found = memory.get(where={"content_hash": {"$in": hashes[i:i + _PAGE]}}, include=["metadatas"])
+        for mem_id, meta in zip(found.get("ids") or [], found.get("metadatas") or []):
+            meta = meta or {}
+            h = meta.get("content_hash")
+            key = (meta.get("created_at", 0), mem_id)
+            if h not in keep:
+                keep[h] = key
+            elif key < keep[h]:
+                drop.append(keep[h][1])
+                keep[h] = key
+            else:
+                drop.append(mem_id)
+
+    _delete(drop)
+    return len(drop)
+
+
+def _recency(meta: dict | None, mem_id: str) -> tuple:
+    meta = meta or {}
+    return meta.get("created_at", 0), meta.get("stored_at", 0), mem_id
+
+
+def dedupe_near(namespace: str, since: int) -> int:
+    """
+    Only items inserted since the last pass (stored_at, not the document's own
+    created_at, so historical imports are covered) are checked, with one batched
+    nearest-neighbour query per type rather than O(n^2). Only raw turn types
+    are considered, matching is limited to the same type, and the newest copy
+    of a pair wins.
+    """
+    where = {"$and": [
+        {"namespace": namespace},
+        {"type": {"$in": list(_NEAR_DEDUP_TYPES)}},
+        {"stored_at": {"$gte": since}},
+    ]}
+    found = _get_all(where, ["embeddings", "metadatas"])
+    if not found["ids"]:
+        return 0
+
+    by_type = defaultdict(list)
+    for mem_id, emb, meta in zip(found["ids"], found["embeddings"], found["metadatas"]):
+        by_type[(meta or {}).get("type")].append((mem_id, emb, meta))
+
+    dropped: set[str] = set()
+
+    for doc_type, items in by_type.items():
+        where = {"$and": [{"namespace": namespace}, {"type": doc_type}]}
+        for i in range(0, len(items), _PAGE):
+            page = items[i:i + _PAGE]
+            res = memory.query(
+                query_embeddings=[list(emb) for _, emb, _ in page],
+                n_results=4,
+                where=where,
+                include=["metadatas", "distances"],
+            )
+
+            for (mem_id, _, meta), n_ids, n_metas, n_dists in zip(
+                page, res["ids"], res["metadatas"], res["distances"]
+            ):
+                if mem_id in dropped:
+                    continue
+                key = _recency(meta, mem_id)
+                for other_id, other_meta, dist in zip(n_ids, n_metas, n_dists):
+                    if other_id == mem_id or other_id in dropped or dist > MEMORY_NEAR_DUP_DISTANCE:
+                        continue
+                    if (other_meta or {}).get("type") != doc_type:
+                        continue
+                    # Keep the newest copy: a near-identical later message is
+                    # usually a correction ("March 3" -> "March 5").
+                    if _recency(other_meta, other_id) > key:
+                        dropped.add(mem_id)
+                        break
+                    dropped.add(other_id)
+
+    _delete(list(dropped))
+    return len(dropped)
+
+
+def _chunks(texts: list[str], limit: int):
+    """
+    Groups texts into chunks of at most `limit` chars; a longer text gets a
+    chunk of its own and is never cut.
+    """
+    chunk, size = [], 0
+    for text in texts:
+        if chunk and size + len(text) + 1 > limit:
+            yield chunk
+            chunk, size = [], 0
+        chunk.append(text)
+        size += len(text) + 1
+    if chunk:
+        yield chunk
+
+
+def _summarize_chunk(client, label: str, texts: list[str]) -> str:
+    resp = client.chat.completions.create(
+        model=MODEL,
+        messages=[
+            {
+                "role": "system",
+                "content": "Summarize these notes into a compact memory. Keep facts, decisions, "
+                           "names, dates, preferences and open tasks. Drop small talk.",
+            },
+            {"role": "user", "content": f"Period: {label}\n\n" + "\n".join(texts)},
+        ],
+        temperature=0.2,
+        timeout=60,
+    )
+    return (resp.choices[0].message.content or "").strip()
+
+
+def _summarize(client, label: str, texts: list[str]) -> str:
+    """
+    Every text reaches the model: a busy period is summarized chunk by chunk,
+    then the partial summaries are summarized in turn. Returns "" if any call
+    comes back empty, so the caller keeps the raw items.
+    """
+    while True:
+        parts = []
+        for chunk in _chunks(texts, ROLLUP_MAX_CHARS):
+            part = _summarize_chunk(client, label, chunk)
+            if not part:
+                return ""
+            parts.append(part)
+        if len(parts) == 1:
+            return parts[0]
+        if len(parts) >= len(texts):
+            # Summaries no longer shrink; keep them all rather than loop.
+            return "\n\n".join(parts)
+        texts = parts
+
+
+def _utc(ts: int) -> datetime.datetime:
+    return datetime.datetime.fromtimestamp(ts, datetime.timezone.utc)
+
+
+def rollup(client, namespace: str, now: int) -> int:
+    """
+    Only whole periods that ended before the tier's cutoff are rolled up, into
+    one summary per (namespace, period). Items that arrive late for a period
+    (e.g. imports) are merged into its existing summary.
+    """
+    rolled = 0
+    for source_types, summary_type, after_days, period_start, period_label in _ROLLUP_TIERS:
+        # Start of the period containing the cutoff: everything before it
+        # belongs to periods that are already complete.
+        boundary = int(period_start(_utc(now - after_days * 86400)).timestamp())
+        where = {"$and": [
+            {"namespace": namespace},
+            {"type": {"$in": list(source_types)}},
+            {"created_at": {"$lt": boundary}},
+        ]}
+        found = _get_all(where, ["documents", "metadatas"])
+
+        periods = defaultdict(list)
+        for mem_id, doc, meta in zip(found["ids"], found["documents"], found["metadatas"]):
+            ts = (meta or {}).get("created_at", 0)
+            period = period_label(period_start(_utc(ts)))
+            periods[period].append((ts, mem_id, doc or "", (meta or {}).get("type")))
+
+        for period, items in periods.items():
+            items.sort()
+            existing = memory.get(
+                where={"$and": [{"namespace": namespace}, {"type": summary_type}, {"period": period}]},
+                include=["documents", "metadatas"],
+            )
+            existing_ids = existing.get("ids") or []
+            existing_docs = existing.get("documents") or []
+            existing_ts = [(m or {}).get("created_at", 0) for m in existing.get("metadatas") or []]
+
+            texts = [f"Earlier summary: {d}" for d in existing_docs if d]
+            texts += [f"{'AI' if t == 'telegram_ai' else 'User' if t == 'telegram_user' else '-'}: {d}"
+                      for _, _, d, t in items]
+            summary = _summarize(client, period, texts)
+            if not summary:
+                continue
+
+            add_memory(summary, {
+                "type": summary_type,
+                "namespace": namespace,
+                "period": period,
+                "created_at": max([items[-1][0], *existing_ts]),
+            })
+            _delete([mem_id for _, mem_id, _, _ in items] + list(existing_ids))
+            rolled += len(items)
+            merged = " (merged into existing)" if existing_ids else ""
+            print(f"[COMPACT-ROLLUP] ns={namespace} {period} {len(items)} -> {summary_type}{merged}")
+    return rolled
+
+
+def compact_all() -> None:
+    now = int(time.time())
+
+    client = None
+    if OPENAI_KEY:
+        from openai import OpenAI
+        client = OpenAI(api_key=OPENAI_KEY)
+
+    migrate_once(now)
+    expired = apply_retention(now)
+    if expired:
+        print(f"[COMPACT] expired={expired}")
+
+    known = _known_namespaces()
+    namespaces = discover_namespaces(min(known.values(), default=0))
+
+    for namespace, last_run in sorted(namespaces.items()):
+        try:
+            exact = dedupe_exact(namespace, last_run)
+            near = dedupe_near(namespace, last_run)
+            rolled = rollup(client, namespace, now) if client else 0
+            _set_last_run(namespace, now)
+            if exact or near or rolled:
+                print(f"[COMPACT] ns={namespace} exact_dups={exact} near_dups={near} rolled_up={rolled}")
+        except Exception as e:
+            print(f"[Compaction error] ns={namespace} {e}")
+
+
+def start_compaction() -> None:
+    print("Compaction loop started")
+
+    while True:
+        try:
+            compact_all()
+        except Exception as e:
+            print(f"[Compaction loop error] {e}")
+
+        time.sleep(COMPACTION_INTERVAL_SECONDS)
+
+
+if __name__ == "__main__":
+    compact_all()
@@ -0,0 +1,118 @@
+import os
+import re
+import time
+import sqlite3
+from collections import OrderedDict, deque
+
+# Last K turns kept per namespace, and how many namespaces stay cached in RAM.
+RECENT_TURNS = int(os.getenv("RECENT_TURNS", "12"))
+RECENT_MAX_NAMESPACES = int(os.getenv("RECENT_MAX_NAMESPACES", "500"))
+
+DB_PATH = os.getenv("BRAIN_DB_PATH", "brain.db")
+
+conn = sqlite3.connect(DB_PATH, check_same_thread=False, timeout=30)
+cursor = conn.cursor()
+
+cursor.execute("""
+CREATE TABLE IF NOT EXISTS conversation_turns (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    namespace TEXT NOT NULL,
+    role TEXT NOT NULL,              -- 'user' or 'assistant'
+    content TEXT NOT NULL,
+    created_at INTEGER NOT NULL
+)
+""")
+cursor.execute("CREATE INDEX IF NOT EXISTS idx_conversation_turns_ns ON conversation_turns (namespace, id)")
+conn.commit()
+
+# namespace -> {"turns": deque[(role, content)], "last_id": int}, least recently used first
+_cache: OrderedDict = OrderedDict()
+
+_WORD = re.compile(r"[a-z0-9']+")
+
+# Words that say nothing about *what* is being asked.
+_STOPWORDS = {
+    "a", "about", "after", "again", "all", "also", "am", "an", "and", "any", "are", "as", "at",
+    "be", "been", "but", "by", "can", "could", "did", "do", "does", "for", "from", "get", "got",
+    "had", "has", "have", "he", "her", "here", "him", "his", "how", "i", "if", "in", "into", "is",
+    "it", "its", "just", "know", "me", "more", "my", "no", "not", "now", "of", "ok", "okay", "on",
+    "or", "our", "please", "she", "should", "so", "tell", "than", "thanks", "that", "the", "their",
+    "them", "then", "there", "these", "they", "this", "to", "us", "was", "we", "were", "what",
+    "when", "where", "which", "who", "whom", "why", "will", "with", "would", "yes", "you", "your",
+}
+
+
+def _entry(namespace: str) -> dict:
+    """
+    Cached ring buffer for a namespace, topped up with rows written since the
+    last read (linked chats may be served by other worker processes).
+    """
+    entry = _cache.get(namespace)
+    if entry is None:
+        cursor.execute(
+            "SELECT id, role, content FROM conversation_turns WHERE namespace = ? ORDER BY id DESC LIMIT ?",
+            (namespace, RECENT_TURNS),
+        )
+        rows = list(reversed(cursor.fetchall()))
+        entry = {"turns": deque(maxlen=RECENT_TURNS), "last_id": 0}
+        _cache[namespace] = entry
+    else:
+        cursor.execute(
+            "SELECT id, role, content FROM conversation_turns WHERE namespace = ? AND id > ? ORDER BY id",
+            (namespace, entry["last_id"]),
+        )
+        rows = cursor.fetchall()
+
+    for row_id, role, content in rows:
+        entry["turns"].append((role, content))
+        entry["last_id"] = row_id
+
+    _cache.move_to_end(namespace)
+    while len(_cache) > RECENT_MAX_NAMESPACES:
+        _cache.popitem(last=False)
+    return entry
+
+
+def recent_turns(namespace: str) -> list[tuple[str, str]]:
+    """
+    Last RECENT_TURNS (role, content) pairs for a namespace, oldest first.
+    """
+    return list(_entry(namespace)["turns"])
+
+
+def add_turn(namespace: str, role: str, content: str) -> None:
+    cursor.execute(
+        "INSERT INTO conversation_turns (namespace, role, content, created_at) VALUES (?, ?, ?, ?)",
+        (namespace, role, content, int(time.time())),
+    )
+    # Only the ring buffer lives here; long-term history is in the vector store.
+    cursor.execute(
+        "DELETE FROM conversation_turns WHERE namespace = ? AND id NOT IN "
+        "(SELECT id FROM conversation_turns WHERE namespace = ? ORDER BY id DESC LIMIT ?)",
+        (namespace, namespace, RECENT_TURNS),
+    )
+    conn.commit()
+    _entry(namespace)
+
+
+def _content_words(text: str) -> set[str]:
+    return {w for w in _WORD.findall(text.lower()) if len(w) > 1 and w not in _STOPWORDS}
+
+
+def covers(turns: list[tuple[str, str]], query: str) -> bool:
+    """
+    True only when every content word of the query already appears in the
+    recent turns, so vector recall would return what is already in the prompt.
+    A query with no content words ("why?") is never treated as covered.
+    """
+    words = _content_words(query)
+    if not turns or not words:
+        return False
+    seen = set()
+    for _, content in turns:
+        seen |= _content_words(content)
+    return words <= seen
+
+
+def format_turns(turns: list[tuple[str, str]]) -> str:
+    return "\n".join(f"{'AI' if role == 'assistant' else 'User'}: {content}" for role, content in turns)
@@ -1,7 +1,7 @@
 import sqlite3
 import uuid
 
-conn = sqlite3.connect("brain.db", check_same_thread=False)
+conn = sqlite3.connect("brain.db", check_same_thread=False, timeout=30)
 cursor = conn.cursor()
 
 cursor.execute("""
@@ -1,11 +1,33 @@
+import os
+import time
 import uuid
+import hashlib
 import chromadb
+from chromadb.utils import embedding_functions
 
-client = chromadb.Client(
-    settings=chromadb.Settings(persist_directory="./chroma_memory")
-)
+# With WORKER_PROCESSES > 1 every worker needs the same store: point them all at
+# a Chroma server (`chroma run --path ./chroma_memory`) via CHROMA_HOST.
+CHROMA_HOST = os.getenv("CHROMA_HOST")
+CHROMA_PORT = int(os.getenv("CHROMA_PORT", "8000"))
 
-memory = client.get_or_create_collection("personal_brain")
+if CHROMA_HOST:
+    client = chromadb.HttpClient(host=CHROMA_HOST, port=CHROMA_PORT)
+else:
+    # PersistentClient: a plain Client(Settings(persist_directory=...)) is in-memory
+    # on chromadb >= 0.4 and would lose everything (including imports) on exit.
+    client = chromadb.PersistentClient(path="./chroma_memory")
+
+# Explicit so bulk loaders can embed outside the collection (see memory_import.py).
+embedding_function = embedding_functions.DefaultEmbeddingFunction()
+
+memory = client.get_or_create_collection("personal_brain", embedding_function=embedding_function)
+
+
+def content_hash(document: str, namespace: str) -> str:
+    """
+    Stable hash of a document within its namespace, stored as meta['content_hash'].
+    """
+    return hashlib.sha256(f"{namespace}\x00{document}".encode("utf-8")).hexdigest()
 
 
 def add_memory(document: str, meta: dict) -> None:
@@ -14,9 +36,38 @@ def add_memory(document: str, meta: dict) -> None:
     IMPORTANT: meta must include 'namespace' for isolation.
     """
     mem_id = f"mem_{uuid.uuid4().hex}"
+    now = int(time.time())
+    meta = {
+        "created_at": now,
+        **meta,
+        "stored_at": now,
+        "content_hash": content_hash(document, meta.get("namespace", "")),
+    }
     memory.add(documents=[document], metadatas=[meta], ids=[mem_id])
 
 
+def add_memories(documents: list[str], metas: list[dict], ids: list[str], embeddings=None) -> None:
+    """
+    Bulk insert. Pass precomputed embeddings to skip embedding inside Chroma.
+    created_at may be historical; stored_at is always the insertion time.
+    """
+    if not documents:
+        return
+    now = int(time.time())
+    metas = [{**m, "stored_at": now} for m in metas]
+    memory.add(documents=documents, metadatas=metas, ids=ids, embeddings=embeddings)
+
+
+def existing_hashes(hashes: list[str]) -> set[str]:
+    """
+    Returns the subset of content hashes already present in the store.
+    """
+    if not hashes:
+        return set()
+    found = memory.get(where={"content_hash": {"$in": hashes}}, include=["metadatas"])
+    return {m.get("content_hash") for m in (found.get("metadatas") or []) if m}
+
+
 def query_memory(query: str, namespace: str, n_results: int = 5) -> list[str]:
     """
     Query memory restricted to a namespace.
@@ -0,0 +1,354 @@
+"""
+Bulk historical import into memory.
+
+    python memory_import.py export.jsonl --namespace tg:12345
+    python memory_import.py archive.mbox --namespace email:default --workers 2
+
+JSONL: one object per line with "text" (or "document"); "namespace", "type" and
+any other scalar keys (or a "meta" object) become metadata.
+mbox: one memory per message (subject + plain-text body).
+
+Progress is checkpointed in brain.db per source file, so re-running the same
+command after an interruption resumes where it stopped.
+"""
+import os
+import sys
+import json
+import time
+import sqlite3
+import mailbox
+import argparse
+import datetime
+import email.utils
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import memory as memory_store
+
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "512"))
+IMPORT_WRITE_CHUNK = int(os.getenv("IMPORT_WRITE_CHUNK", "4096"))
+# The ONNX embedder is already multi-threaded, so one process uses every core;
+# extra workers only pay off on machines with many cores.
+IMPORT_WORKERS = int(os.getenv("IMPORT_WORKERS", "1"))
+
+DB_PATH = os.getenv("BRAIN_DB_PATH", "brain.db")
+
+conn = sqlite3.connect(DB_PATH, check_same_thread=False, timeout=30)
+cursor = conn.cursor()
+
+cursor.execute("""
+CREATE TABLE IF NOT EXISTS memory_imports (
+    source TEXT PRIMARY KEY,
+    position INTEGER NOT NULL,       -- records consumed and written
+    imported INTEGER DEFAULT 0,
+    skipped INTEGER DEFAULT 0,
+    updated_at TEXT
+)
+""")
+conn.commit()
+
+
+def _load_checkpoint(source: str) -> tuple[int, int, int]:
+    cursor.execute("SELECT position, imported, skipped FROM memory_imports WHERE source = ?", (source,))
+    row = cursor.fetchone()
+    return tuple(row) if row else (0, 0, 0)
+
+
+def _save_checkpoint(source: str, position: int, imported: int, skipped: int) -> None:
+    cursor.execute(
+        "INSERT OR REPLACE INTO memory_imports (source, position, imported, skipped, updated_at) VALUES (?, ?, ?, ?, ?)",
+        (source, position, imported, skipped, datetime.datetime.utcnow().isoformat()),
+    )
+    conn.commit()
+
+
+def reset_checkpoint(source: str) -> None:
+    cursor.execute("DELETE FROM memory_imports WHERE source = ?", (source,))
+    conn.commit()
+
+
+# -------------------------
+# Readers: yield (document, meta)
+# -------------------------
+
+def read_jsonl(path: str, namespace: str | None = None, doc_type: str = "import"):
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                yield None, None
+                continue
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                rec = None
+            if not isinstance(rec, dict):
+                yield None, None
+                continue
+
+            text = rec.pop("text", None)
+            document = rec.pop("document", None)
+            nested = rec.pop("meta", None) or {}
+            meta = {**rec, **nested}
+            # Chroma metadata only takes scalars.
+            meta = {k: v for k, v in meta.items() if isinstance(v, (str, int, float, bool))}
+            meta.setdefault("type", doc_type)
+            if namespace:
+                meta.setdefault("namespace", namespace)
+            yield text or document, meta
+
+
+def _mbox_body(msg) -> str:
+    if msg.is_multipart():
+        parts = [p for p in msg.walk() if p.get_content_type() == "text/plain"]
+    else:
+        parts = [msg]
+
+    body = ""
+    for part in parts:
+        payload = part.get_payload(decode=True)
+        if payload:
+            body += payload.decode(part.get_content_charset() or "utf-8", errors="replace")
+    return body
+
+
+def read_mbox(path: str, namespace: str | None = None, doc_type: str = "email_archive"):
+    for msg in mailbox.mbox(path, create=False):
+        subject = str(msg.get("subject") or "")
+        body = _mbox_body(msg).strip()
+        if not body:
+            yield None, None
+            continue
+
+        meta = {"type": doc_type, "subject": subject}
+        if msg.get("from"):
+            meta["from"] = str(msg["from"])
+        if msg.get("date"):
+            meta["date"] = str(msg["date"])
+        if namespace:
+            meta["namespace"] = namespace
+        yield f"Subject: {subject}\n\n{body}" if subject else body, meta
+
+
+# -------------------------
+# Embedding (optionally in a process pool)
+# -------------------------
+
+_worker_embed = None
+
+
+def _init_embed_worker() -> None:
+    global _worker_embed
+    from chromadb.utils import embedding_functions
+    _worker_embed = embedding_functions.DefaultEmbeddingFunction()
+
+
+def _embed_in_worker(docs: list[str]):
+    return _worker_embed(docs)
+
+
+def _parse_timestamp(value) -> int | None:
+    """
+    Epoch seconds from a number, numeric string, ISO-8601 or RFC 2822 date.
+    """
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    text = str(value).strip()
+    if not text:
+        return None
+    try:
+        return int(float(text))
+    except ValueError:
+        pass
+    try:
+        dt = datetime.datetime.fromisoformat(text.replace("Z", "+00:00"))
+    except ValueError:
+        try:
+            dt = email.utils.parsedate_to_datetime(text)
+        except (TypeError, ValueError):
+            return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=datetime.timezone.utc)
+    return int(dt.timestamp())
+
+
+def _created_at(meta: dict, default: int) -> int:
+    # Telegram exports carry "date" (ISO) and "date_unixtime"; the import time is a last resort.
+    for key in ("created_at", "date_unixtime", "date"):
+        ts = _parse_timestamp(meta.get(key))
+        if ts is not None:
+            return ts
+    return default
+
+
+def _prepare_batch(batch: list, seen: set[str]):
+    """
+    Drops empty records and duplicates (within this run and already stored).
+    Returns (docs, metas, ids, skipped).
+    """
+    docs, metas, ids = [], [], []
+    skipped = 0
+    now = int(time.time())
+
+    for text, meta in batch:
+        if not text or not meta or not meta.get("namespace"):
+            skipped += 1
+            continue
+        h = memory_store.content_hash(text, meta["namespace"])
+        if h in seen:
+            skipped += 1
+            continue
+        seen.add(h)
+        docs.append(text)
+        metas.append({**meta, "created_at": _created_at(meta, now), "content_hash": h})
+        ids.append(f"mem_{h[:32]}")
+
+    stored = memory_store.existing_hashes([m["content_hash"] for m in metas])
+    if stored:
+        keep = [i for i, m in enumerate(metas) if m["content_hash"] not in stored]
+        skipped += len(docs) - len(keep)
+        docs = [docs[i] for i in keep]
+        metas = [metas[i] for i in keep]
+        ids = [ids[i] for i in keep]
+
+    return docs, metas, ids, skipped
+
+
+def import_records(
+    records,
+    source: str,
+    workers: int = 1,
+    batch_size: int = IMPORT_BATCH_SIZE,
+    write_chunk: int = IMPORT_WRITE_CHUNK,
+) -> dict:
+    """
+    Streams (document, meta) records into memory.
+
+    Embeds in batches of batch_size (across `workers` processes if > 1), writes
+    in chunks of write_chunk, and checkpoints `source` after every write.
+    Every meta must carry a 'namespace'; records without one are skipped.
+    """
+    position, imported, skipped = _load_checkpoint(source)
+    if position:
+        print(f"[IMPORT] resuming {source} at record {position}")
+
+    started = time.time()
+    run_imported = 0
+    consumed = position
+    # Hashes of records prepared but not yet written (pending + buffer).
+    seen: set[str] = set()
+
+    pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_embed_worker) if workers > 1 else None
+    # (embeddings or Future, docs, metas, ids, skipped, records consumed) in read order
+    pending: deque = deque()
+    buf_docs, buf_metas, buf_ids, buf_embs = [], [], [], []
+
+    def flush() -> None:
+        nonlocal imported, run_imported
+        memory_store.add_memories(buf_docs, buf_metas, buf_ids, embeddings=buf_embs)
+        # Written items are caught by existing_hashes from now on, so `seen`
+        # only has to cover batches that are prepared but not yet written.
+        seen.difference_update(m["content_hash"] for m in buf_metas)
+        imported += len(buf_docs)
+        run_imported += len(buf_docs)
+        buf_docs.clear()
+        buf_metas.clear()
+        buf_ids.clear()
+        buf_embs.clear()
+        _save_checkpoint(source, consumed, imported, skipped)
+        rate = run_imported / max(time.time() - started, 1e-6)
+        print(f"[IMPORT] {source} position={consumed} imported={imported} skipped={skipped} rate={rate:.0f}/s")
+
+    def drain(limit: int) -> None:
+        nonlocal consumed, skipped
+        while len(pending) > limit:
+            embs, docs, metas, ids, dropped, upto = pending.popleft()
+            if pool and docs:
+                embs = embs.result()
+            buf_docs.extend(docs)
+            buf_metas.extend(metas)
+            buf_ids.extend(ids)
+            buf_embs.extend(embs)
+            # Counted with `consumed` so a resumed run never counts a skip twice.
+            skipped += dropped
+            consumed = upto
+            if len(buf_docs) >= write_chunk:
+                flush()
+
+    def submit(batch: list, upto: int) -> None:
+        docs, metas, ids, dropped = _prepare_batch(batch, seen)
+        if not docs:
+            embs = []
+        elif pool:
+            embs = pool.submit(_embed_in_worker, docs)
+        else:
+            embs = memory_store.embedding_function(docs)
+        pending.append((embs, docs, metas, ids, dropped, upto))
+        # Bounded window of in-flight batches so memory stays flat on huge inputs.
+        drain(workers * 2)
+
+    try:
+        batch = []
+        index = position
+        for index, record in enumerate(records, start=1):
+            if index <= position:
+                continue
+            batch.append(record)
+            if len(batch) >= batch_size:
+                submit(batch, index)
+                batch = []
+        if batch:
+            submit(batch, index)
+
+        drain(0)
+        flush()
+    finally:
+        if pool:
+            pool.shutdown(cancel_futures=True)
+
+    elapsed = time.time() - started
+    print(f"[IMPORT-DONE] {source} imported={imported} skipped={skipped} in {elapsed:.1f}s")
+    return {"source": source, "position": consumed, "imported": imported, "skipped": skipped}
+
+
+def import_file(
+    path: str,
+    namespace: str | None = None,
+    fmt: str | None = None,
+    doc_type: str | None = None,
+    workers: int = 1,
+    restart: bool = False,
+) -> dict:
+    source = os.path.abspath(path)
+    if restart:
+        reset_checkpoint(source)
+
+    fmt = fmt or ("mbox" if path.endswith(".mbox") else "jsonl")
+    if fmt == "mbox":
+        records = read_mbox(path, namespace, doc_type or "email_archive")
+    elif fmt == "jsonl":
+        records = read_jsonl(path, namespace, doc_type or "import")
+    else:
+        raise ValueError(f"Unsupported import format: {fmt}")
+
+    return import_records(records, source, workers=workers)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Bulk import JSONL or mbox into memory.")
+    parser.add_argument("path")
+    parser.add_argument("--namespace", help="default namespace for records without one, e.g. tg:12345")
+    parser.add_argument("--format", choices=["jsonl", "mbox"], dest="fmt")
+    parser.add_argument("--type", dest="doc_type", help="meta 'type' for records without one")
+    parser.add_argument("--workers", type=int, default=IMPORT_WORKERS, help="embedding processes (default 1)")
+    parser.add_argument("--restart", action="store_true", help="ignore the saved checkpoint")
+    args = parser.parse_args(argv)
+
+    import_file(args.path, args.namespace, args.fmt, args.doc_type, args.workers, args.restart)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -9,9 +9,12 @@ API_URL = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}" if TELEGRAM_TOKEN else
 
 DB_PATH = os.getenv("BRAIN_DB_PATH", "brain.db")
 
-conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+conn = sqlite3.connect(DB_PATH, check_same_thread=False, timeout=30)
 cursor = conn.cursor()
 
+# WAL lets worker processes read brain.db while another process writes.
+cursor.execute("PRAGMA journal_mode=WAL")
+
 
 def _table_exists(name: str) -> bool:
     cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (name,))
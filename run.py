@@ -3,6 +3,8 @@ import time
 
 from telegram_bot import start_telegram
 from reminders import start_reminders
+from compaction import start_compaction
+from workers import WORKER_PROCESSES, require_shared_store, start_sharded_telegram
 
 # If you have email enabled, you can add it back later:
 # from main import start_email_loop
@@ -10,8 +12,17 @@ from reminders import start_reminders
 if __name__ == "__main__":
     print("AI Brain starting (Telegram + Reminders)")
 
-    threading.Thread(target=start_telegram, daemon=True).start()
+    # Fail before starting anything rather than inside a daemon thread.
+    require_shared_store(WORKER_PROCESSES)
+
+    # This process is the leader: reminders and compaction only ever run here.
     threading.Thread(target=start_reminders, daemon=True).start()
+    threading.Thread(target=start_compaction, daemon=True).start()
+
+    if WORKER_PROCESSES > 1:
+        threading.Thread(target=start_sharded_telegram, args=(WORKER_PROCESSES,), daemon=True).start()
+    else:
+        threading.Thread(target=start_telegram, daemon=True).start()
 
     # If needed later:
     # threading.Thread(target=start_email_loop, daemon=True).start()
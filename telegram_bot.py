@@ -11,6 +11,7 @@ from openai import OpenAI
 
 from memory import add_memory, query_memory
 from reminders import add_reminder
+from conversation import recent_turns, add_turn, covers, format_turns
 from links import get_namespace_for_chat, create_link_for_chat, join_link_for_chat, unlink_chat
 
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
@@ -28,10 +29,13 @@ MODEL = os.getenv("OPENAI_MODEL", "gpt-4.1-mini")
 MAX_MEMORY_SNIPPETS = int(os.getenv("MAX_MEMORY_SNIPPETS", "5"))
 OPENAI_TIMEOUT_SECONDS = int(os.getenv("OPENAI_TIMEOUT_SECONDS", "25"))
 POLL_SLEEP_SECONDS = float(os.getenv("POLL_SLEEP_SECONDS", "0.5"))
+# Telegram keeps unconfirmed updates for 24h; keep ledger entries a bit longer.
+LEDGER_RETENTION_SECONDS = int(os.getenv("LEDGER_RETENTION_SECONDS", str(3 * 86400)))
+# A 'started' ledger row older than this is assumed to belong to a dead handler.
+CLAIM_TIMEOUT_SECONDS = int(os.getenv("CLAIM_TIMEOUT_SECONDS", "300"))
 
 DEFAULT_TZ = os.getenv("DEFAULT_TIMEZONE", "Asia/Dubai")
 
-_last_update_id = None
 _tzf = TimezoneFinder()
 
 # Reminder intent phrases (natural language)
@@ -59,7 +63,7 @@ def send_message(chat_id: int, text: str) -> None:
 # -------------------------
 import sqlite3
 _DB_PATH = os.getenv("BRAIN_DB_PATH", "brain.db")
-_conn = sqlite3.connect(_DB_PATH, check_same_thread=False)
+_conn = sqlite3.connect(_DB_PATH, check_same_thread=False, timeout=30)
 _cur = _conn.cursor()
 
 _cur.execute("""
@@ -258,14 +262,131 @@ def try_parse_reminder(user_text: str, tzname: str):
     return due_at, reminder_text, f"{local_dt_str} ({tzname})"
 
 
-def start_telegram() -> None:
+# -------------------------
+# Durable update offset + idempotency ledger (SQLite)
+# -------------------------
+_cur.execute("""
+CREATE TABLE IF NOT EXISTS telegram_state (
+    key TEXT PRIMARY KEY,
+    value TEXT
+)
+""")
+_cur.execute("""
+CREATE TABLE IF NOT EXISTS processed_updates (
+    update_id INTEGER PRIMARY KEY,
+    status TEXT NOT NULL DEFAULT 'done',   -- 'started' on claim, 'done' once handled
+    processed_at INTEGER NOT NULL
+)
+""")
+_cur.execute("PRAGMA table_info(processed_updates)")
+if "status" not in {row[1] for row in _cur.fetchall()}:
+    _cur.execute("ALTER TABLE processed_updates ADD COLUMN status TEXT NOT NULL DEFAULT 'done'")
+_conn.commit()
+
+_last_pruned = 0.0
+
+
+def _load_offset():
+    _cur.execute("SELECT value FROM telegram_state WHERE key = 'last_update_id'")
+    row = _cur.fetchone()
+    return int(row[0]) if row and row[0] is not None else None
+
+
+def _save_offset(update_id: int) -> None:
+    """
+    Called once per getUpdates batch, not per update.
+    """
+    global _last_pruned
+    _cur.execute(
+        "INSERT OR REPLACE INTO telegram_state (key, value) VALUES ('last_update_id', ?)",
+        (str(update_id),),
+    )
+    now = time.time()
+    if now - _last_pruned > 3600:
+        _cur.execute(
+            "DELETE FROM processed_updates WHERE processed_at < ?",
+            (int(now) - LEDGER_RETENTION_SECONDS,),
+        )
+        _last_pruned = now
+    _conn.commit()
+
+
+def claim_update(update_id) -> bool:
+    """
+    Marks update_id 'started' in the ledger. False means it is done or being
+    handled right now (e.g. redelivered after a restart), so the caller must
+    skip it. A 'started' row older than CLAIM_TIMEOUT_SECONDS, or released by
+    release_stale_claims(), is claimed again: its handler died mid-update.
+    """
+    if update_id is None:
+        return True
+    now = int(time.time())
+    _cur.execute(
+        "INSERT OR IGNORE INTO processed_updates (update_id, status, processed_at) VALUES (?, 'started', ?)",
+        (int(update_id), now),
+    )
+    claimed = _cur.rowcount == 1
+    if not claimed:
+        _cur.execute(
+            "UPDATE processed_updates SET processed_at = ? "
+            "WHERE update_id = ? AND status = 'started' AND processed_at < ?",
+            (now, int(update_id), now - CLAIM_TIMEOUT_SECONDS),
+        )
+        claimed = _cur.rowcount == 1
+    _conn.commit()
+    return claimed
+
+
+def finish_update(update_id) -> None:
+    if update_id is None:
+        return
+    _cur.execute("UPDATE processed_updates SET status = 'done' WHERE update_id = ?", (int(update_id),))
+    _conn.commit()
+
+
+def release_stale_claims(update_ids: list[int] | None = None) -> None:
+    """
+    Makes 'started' claims reclaimable at once. Called when no handler can be
+    running them any more: at startup, or for a worker that was restarted.
+    """
+    if update_ids is None:
+        _cur.execute("UPDATE processed_updates SET processed_at = 0 WHERE status = 'started'")
+    else:
+        for i in range(0, len(update_ids), 500):
+            chunk = [int(u) for u in update_ids[i:i + 500]]
+            _cur.execute(
+                "UPDATE processed_updates SET processed_at = 0 WHERE status = 'started' "
+                f"AND update_id IN ({','.join('?' * len(chunk))})",
+                chunk,
+            )
+    _conn.commit()
+
+
+_last_update_id = _load_offset()
+
+
+def update_chat_id(update: dict):
+    """
+    Returns the chat_id an update belongs to, or None for updates we ignore.
+    """
+    msg = update.get("message") or {}
+    chat = msg.get("chat") or {}
+    return chat.get("id")
+
+
+def poll_updates(ack=None):
+    """
+    Long-polls getUpdates and yields raw updates in order.
+
+    After each batch the offset moves to the highest update_id that is safely
+    handled and is persisted, so a restart resumes from it. By default that is
+    everything yielded (the caller handles updates inline); otherwise `ack()`
+    returns it, e.g. once the batch is durably queued. Updates past the offset
+    are redelivered by Telegram, so the caller must tolerate seeing them again.
+    """
     global _last_update_id
-    print("Telegram bot started (polling mode)")
 
     while True:
-        chat_id = None
-        user_text = None
-
         try:
             params = {"timeout": 30}
             if _last_update_id is not None:
@@ -274,96 +395,160 @@ def start_telegram() -> None:
             r = requests.get(f"{API_URL}/getUpdates", params=params, timeout=35)
             data = r.json()
 
-            for update in data.get("result", []):
-                _last_update_id = update.get("update_id", _last_update_id)
-
-                msg = update.get("message")
-                if not msg:
-                    continue
-
-                chat = msg.get("chat") or {}
-                chat_id = chat.get("id")
-                if chat_id is None:
-                    continue
-
-                # Location-based timezone autodetection
-                if try_autodetect_timezone_from_location(chat_id, msg):
-                    continue
-
-                user_text = msg.get("text")
-                if not user_text:
-                    continue
-
-                user_text = user_text.strip()
-                if not user_text:
-                    continue
-
-                print(f"[TG] chat_id={chat_id} text={user_text!r}")
-
-                # Natural language timezone set
-                if try_set_timezone_from_text(chat_id, user_text):
-                    continue
-
-                # Optional linking commands
-                if handle_linking_commands(chat_id, user_text):
-                    continue
-
-                # Determine isolation namespace
-                namespace = get_namespace_for_chat(chat_id)
-
-                # Natural language reminders (no model call)
-                tzname = get_chat_timezone(chat_id)
-                parsed = try_parse_reminder(user_text, tzname)
-                if parsed:
-                    due_at, reminder_text, local_dt_str = parsed
-                    add_reminder(
-                        chat_id=chat_id,
-                        text=reminder_text,
-                        due_at=due_at,
-                        timezone=tzname,
-                        due_local=local_dt_str,
-                    )
-                    print(f"[REMINDER-SET] chat_id={chat_id} due_at_utc={due_at} tz={tzname} text={reminder_text!r}")
-                    send_message(chat_id, f"Confirmed. I’ll remind you at {local_dt_str}.\nReminder: {reminder_text}")
-                    continue
-
-                # Memory context (namespaced)
-                memories = query_memory(user_text, namespace=namespace, n_results=MAX_MEMORY_SNIPPETS)
-                mem_text = "\n".join(memories[:MAX_MEMORY_SNIPPETS]).strip()
-
-                system = (
-                    "You are Mina's personal AI brain.\n"
-                    "Be direct, concise, and action-oriented.\n"
-                    "Do not repeat an intro message.\n"
-                    "If the user asks for reminders, comply by confirming time and message.\n"
-                )
-
-                prompt = (
-                    f"Relevant memory:\n{mem_text}\n\n"
-                    f"User timezone: {tzname}\n\n"
-                    f"User message:\n{user_text}"
-                )
-
-                resp = client.chat.completions.create(
-                    model=MODEL,
-                    messages=[
-                        {"role": "system", "content": system},
-                        {"role": "user", "content": prompt},
-                    ],
-                    temperature=0.4,
-                    timeout=OPENAI_TIMEOUT_SECONDS,
-                )
-
-                reply = (resp.choices[0].message.content or "").strip()
-                if not reply:
-                    reply = "I received your message. Please rephrase it in one sentence."
-
-                add_memory(user_text, {"type": "telegram_user", "chat_id": str(chat_id), "namespace": namespace})
-                add_memory(reply, {"type": "telegram_ai", "chat_id": str(chat_id), "namespace": namespace})
-
-                send_message(chat_id, reply)
+            updates = data.get("result", [])
+            for update in updates:
+                yield update
+
+            if ack:
+                acked = ack()
+            else:
+                acked = updates[-1].get("update_id") if updates else None
+            if acked is not None and acked != _last_update_id:
+                _last_update_id = acked
+                _save_offset(acked)
 
         except Exception as e:
-            print(f"[Telegram loop error] {e} | chat_id={chat_id} | user_text={repr(user_text)}")
+            print(f"[Telegram poll error] {e}")
 
         time.sleep(POLL_SLEEP_SECONDS)
+
+
+def handle_update(update: dict) -> bool:
+    """
+    Handles one update at most once per successful run. Returns False when the
+    ledger could not be reached, so the caller should retry the update later.
+    """
+    update_id = update.get("update_id")
+    try:
+        if not claim_update(update_id):
+            print(f"[TG] skipping already processed update_id={update_id}")
+            return True
+    except sqlite3.Error as e:
+        print(f"[TG] ledger unavailable, will retry update_id={update_id}: {e}")
+        return False
+
+    _process_update(update)
+
+    try:
+        finish_update(update_id)
+    except sqlite3.Error as e:
+        # Stays 'started'; reclaimed after CLAIM_TIMEOUT_SECONDS if redelivered.
+        print(f"[TG] could not mark update_id={update_id} done: {e}")
+    return True
+
+
+def _process_update(update: dict) -> None:
+    chat_id = None
+    user_text = None
+
+    try:
+        msg = update.get("message")
+        if not msg:
+            return
+
+        chat_id = update_chat_id(update)
+        if chat_id is None:
+            return
+
+        # Location-based timezone autodetection
+        if try_autodetect_timezone_from_location(chat_id, msg):
+            return
+
+        user_text = msg.get("text")
+        if not user_text:
+            return
+
+        user_text = user_text.strip()
+        if not user_text:
+            return
+
+        print(f"[TG] chat_id={chat_id} text={user_text!r}")
+
+        # Natural language timezone set
+        if try_set_timezone_from_text(chat_id, user_text):
+            return
+
+        # Optional linking commands
+        if handle_linking_commands(chat_id, user_text):
+            return
+
+        # Determine isolation namespace
+        namespace = get_namespace_for_chat(chat_id)
+
+        # Natural language reminders (no model call)
+        tzname = get_chat_timezone(chat_id)
+        parsed = try_parse_reminder(user_text, tzname)
+        if parsed:
+            due_at, reminder_text, local_dt_str = parsed
+            add_reminder(
+                chat_id=chat_id,
+                text=reminder_text,
+                due_at=due_at,
+                timezone=tzname,
+                due_local=local_dt_str,
+            )
+            print(f"[REMINDER-SET] chat_id={chat_id} due_at_utc={due_at} tz={tzname} text={reminder_text!r}")
+            send_message(chat_id, f"Confirmed. I’ll remind you at {local_dt_str}.\nReminder: {reminder_text}")
+            return
+
+        # Recent turns come from the ring buffer, in order; vector recall is
+        # only for older context the buffer does not already hold.
+        turns = recent_turns(namespace)
+        if covers(turns, user_text):
+            memories = []
+        else:
+            in_buffer = {content for _, content in turns}
+            memories = query_memory(user_text, namespace=namespace, n_results=MAX_MEMORY_SNIPPETS + len(turns))
+            memories = [m for m in memories if m not in in_buffer]
+        mem_text = "\n".join(memories[:MAX_MEMORY_SNIPPETS]).strip()
+        recent_text = format_turns(turns)
+
+        system = (
+            "You are Mina's personal AI brain.\n"
+            "Be direct, concise, and action-oriented.\n"
+            "Do not repeat an intro message.\n"
+            "If the user asks for reminders, comply by confirming time and message.\n"
+        )
+
+        prompt = (
+            f"Relevant memory:\n{mem_text}\n\n"
+            f"Recent conversation:\n{recent_text}\n\n"
+            f"User timezone: {tzname}\n\n"
+            f"User message:\n{user_text}"
+        )
+
+        resp = client.chat.completions.create(
+            model=MODEL,
+            messages=[
+                {"role": "system", "content": system},
+                {"role": "user", "content": prompt},
+            ],
+            temperature=0.4,
+            timeout=OPENAI_TIMEOUT_SECONDS,
+        )
+
+        reply = (resp.choices[0].message.content or "").strip()
+        if not reply:
+            reply = "I received your message. Please rephrase it in one sentence."
+
+        add_memory(user_text, {"type": "telegram_user", "chat_id": str(chat_id), "namespace": namespace})
+        add_memory(reply, {"type": "telegram_ai", "chat_id": str(chat_id), "namespace": namespace})
+        add_turn(namespace, "user", user_text)
+        add_turn(namespace, "assistant", reply)
+
+        send_message(chat_id, reply)
+
+    except Exception as e:
+        print(f"[Telegram loop error] {e} | chat_id={chat_id} | user_text={repr(user_text)}")
+
+
+def start_telegram() -> None:
+    print("Telegram bot started (polling mode)")
+
+    # Nothing else handles updates in this mode: claims left 'started' by a
+    # previous run died with it and must be redone.
+    release_stale_claims()
+
+    for update in poll_updates():
+        while not handle_update(update):
+            time.sleep(POLL_SLEEP_SECONDS)
@@ -0,0 +1,153 @@
+import os
+import json
+import time
+import sqlite3
+import multiprocessing as mp
+
+WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", "1"))
+WORKER_POLL_SECONDS = float(os.getenv("WORKER_POLL_SECONDS", "0.2"))
+WORKER_BATCH_SIZE = int(os.getenv("WORKER_BATCH_SIZE", "100"))
+
+# "spawn" so each worker opens its own SQLite/Chroma/OpenAI handles instead of
+# inheriting the parent's connections through fork.
+_ctx = mp.get_context("spawn")
+
+DB_PATH = os.getenv("BRAIN_DB_PATH", "brain.db")
+
+conn = sqlite3.connect(DB_PATH, check_same_thread=False, timeout=30)
+cursor = conn.cursor()
+
+# Durable hand-off between the ingest process and the workers: an update is in
+# here before Telegram's offset moves past it, and leaves once it is handled.
+cursor.execute("""
+CREATE TABLE IF NOT EXISTS update_inbox (
+    update_id INTEGER PRIMARY KEY,
+    chat_id INTEGER,
+    shard INTEGER NOT NULL,
+    payload TEXT NOT NULL,           -- raw update JSON
+    received_at INTEGER NOT NULL
+)
+""")
+cursor.execute("CREATE INDEX IF NOT EXISTS idx_update_inbox_shard ON update_inbox (shard, update_id)")
+conn.commit()
+
+
+def shard_for_chat(chat_id, n_shards: int) -> int:
+    """
+    Stable chat -> worker mapping. All updates of one chat land on the same
+    worker, which drains its shard in update_id order, so per-chat ordering holds.
+    """
+    if chat_id is None:
+        return 0
+    return abs(int(chat_id)) % n_shards
+
+
+def _drain_shard(index: int, handle_update) -> bool:
+    """
+    Handles the oldest pending updates of one shard. Returns False when there
+    was nothing to do or an update has to be retried later.
+    """
+    cursor.execute(
+        "SELECT update_id, payload FROM update_inbox WHERE shard = ? ORDER BY update_id LIMIT ?",
+        (index, WORKER_BATCH_SIZE),
+    )
+    rows = cursor.fetchall()
+    if not rows:
+        return False
+
+    for update_id, payload in rows:
+        if not handle_update(json.loads(payload)):
+            # Ledger unavailable: stop here so later updates of the chat wait.
+            return False
+        cursor.execute("DELETE FROM update_inbox WHERE update_id = ?", (update_id,))
+        conn.commit()
+    return True
+
+
+def _worker_main(index: int) -> None:
+    # Imported here so the module-level clients are created inside the worker.
+    from telegram_bot import handle_update
+
+    print(f"[WORKER-{index}] started pid={os.getpid()}")
+
+    while True:
+        try:
+            if _drain_shard(index, handle_update):
+                continue
+        except Exception as e:
+            print(f"[WORKER-{index} error] {e}")
+
+        time.sleep(WORKER_POLL_SECONDS)
+
+
+def _start_worker(index: int):
+    p = _ctx.Process(target=_worker_main, args=(index,), name=f"tg-worker-{index}", daemon=True)
+    p.start()
+    return p
+
+
+def _reshard(n_workers: int) -> None:
+    # Updates left over from a run with a different WORKER_PROCESSES.
+    cursor.execute("UPDATE update_inbox SET shard = COALESCE(ABS(chat_id) % ?, 0)", (n_workers,))
+    conn.commit()
+
+
+def _shard_update_ids(index: int) -> list[int]:
+    cursor.execute("SELECT update_id FROM update_inbox WHERE shard = ?", (index,))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def require_shared_store(n_workers: int = WORKER_PROCESSES) -> None:
+    """
+    Each worker opens its own memory client; without a Chroma server they would
+    each get a private store and memories would split by shard.
+    """
+    if n_workers > 1 and not os.getenv("CHROMA_HOST"):
+        raise ValueError("WORKER_PROCESSES > 1 requires CHROMA_HOST (a shared Chroma server)")
+
+
+def start_sharded_telegram(n_workers: int = WORKER_PROCESSES) -> None:
+    """
+    Ingest loop: polls Telegram in this process and shards updates by chat_id
+    into the update_inbox table, which n_workers worker processes drain.
+    """
+    require_shared_store(n_workers)
+
+    from telegram_bot import poll_updates, update_chat_id, release_stale_claims
+
+    # No worker is running yet, so earlier 'started' claims belong to dead ones.
+    _reshard(n_workers)
+    release_stale_claims()
+
+    procs = [_start_worker(i) for i in range(n_workers)]
+    last_received = None
+
+    def ack():
+        # The batch is durable before Telegram's offset moves past it.
+        conn.commit()
+
+        # Supervised on every poll, whether or not updates arrive for a shard.
+        for i, p in enumerate(procs):
+            if not p.is_alive():
+                print(f"[WORKER-{i}] died (exitcode={p.exitcode}), restarting")
+                release_stale_claims(_shard_update_ids(i))
+                procs[i] = _start_worker(i)
+
+        return last_received
+
+    print(f"Telegram bot started (polling mode, {n_workers} workers)")
+
+    for update in poll_updates(ack=ack):
+        chat_id = update_chat_id(update)
+        cursor.execute(
+            "INSERT OR IGNORE INTO update_inbox (update_id, chat_id, shard, payload, received_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (
+                update.get("update_id"),
+                chat_id,
+                shard_for_chat(chat_id, n_workers),
+                json.dumps(update),
+                int(time.time()),
+            ),
+        )
+        last_received = update.get("update_id", last_received)